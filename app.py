@@ -1,89 +1,258 @@
 from flask import Flask, request, jsonify
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.exceptions import RequestEntityTooLarge
 from flask_cors import CORS
 import PyPDF2
+import pypdfium2 as pdfium
+import pypdfium2.raw as pdfium_c
 import io
-import base64
+import ctypes
+import pybase64
+import orjson
 import logging
-import tempfile
 import os
-
-# OCR imports
-import pytesseract
-from pdf2image import convert_from_bytes
-from PIL import Image
+import re
+import queue
+import collections
+import threading
+import concurrent.futures
+import functools
+import hashlib
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, 
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Rendering resolution for OCR; 200 DPI is enough for body text
+DEFAULT_OCR_DPI = 200
+MIN_OCR_DPI = 72
+MAX_OCR_DPI = 600
+
+# Largest accepted file, after base64 decoding. Flask enforces it for multipart
+# forms; JSON and raw bodies are checked against it before being read or decoded.
+MAX_UPLOAD_MB = int(os.environ.get('MAX_UPLOAD_MB', 50))
+MAX_UPLOAD_BYTES = MAX_UPLOAD_MB * 1024 * 1024
+
+# JSON bodies carry the file base64-encoded, which is 4/3 the decoded size,
+# plus some room for the other fields
+MAX_JSON_BODY_BYTES = MAX_UPLOAD_BYTES * 4 // 3 + 64 * 1024
+
+# Binary uploads are read from the request stream in fixed-size chunks
+RAW_UPLOAD_MIMETYPES = ('application/pdf', 'application/octet-stream')
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Magic bytes of supported image formats: JPG, PNG, BMP, GIF, TIFF
+IMAGE_SIGNATURE = re.compile(
+    rb'\xff\xd8\xff'
+    rb'|\x89PNG\r\n\x1a\n'
+    rb'|BM'
+    rb'|GIF8[79]a'
+    rb'|II\*\x00'
+    rb'|MM\x00\*'
+)
+
+# Pages checked for embedded text before a PDF is treated as scanned
+SCANNED_PROBE_PAGES = 3
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider that parses requests and renders responses with orjson
+    
+    orjson writes UTF-8 directly instead of escaping non-ASCII text, and
+    response bodies are passed to Flask as bytes without an interim string.
+    """
+    
+    def dumps(self, obj, **kwargs):
+        try:
+            return orjson.dumps(obj, default=self.default).decode()
+        except orjson.JSONEncodeError:
+            # orjson rejects lone surrogates, which PyPDF2 can extract
+            return super().dumps(obj, **kwargs)
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        try:
+            body = orjson.dumps(obj, default=self.default)
+        except orjson.JSONEncodeError:
+            return super().response(*args, **kwargs)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
 CORS(app)  # Enable CORS for all routes
 
+# CPUs this process may run on; os.cpu_count() reports every host core
+if hasattr(os, 'sched_getaffinity'):
+    AVAILABLE_CPUS = len(os.sched_getaffinity(0))
+else:
+    AVAILABLE_CPUS = os.cpu_count() or 1
+
+# Gunicorn worker processes (see gunicorn.conf.py); one per CPU by default
+WEB_WORKERS = max(1, int(os.environ.get('WEB_CONCURRENCY', AVAILABLE_CPUS)))
+
+# OCR threads per request, splitting the CPUs between the workers; tesseract
+# gains little beyond 4 cores per document
+MAX_OCR_WORKERS = max(1, min(4, AVAILABLE_CPUS // WEB_WORKERS))
+
+@functools.lru_cache(maxsize=1)
+def load_ocr_modules():
+    """Import the OCR libraries on first use, so workers that only handle
+    born-digital PDFs never load them"""
+    import tesserocr
+    from PIL import Image
+    return tesserocr, Image
+
+# Loaded tesseract engines, reused across requests to avoid reloading the model.
+# At most MAX_OCR_WORKERS engines exist; further callers wait for a free one.
+_tess_api_pool = queue.LifoQueue()
+_tess_api_slots = threading.BoundedSemaphore(MAX_OCR_WORKERS)
+
+def acquire_tess_api():
+    """Take a loaded tesseract engine from the pool, or start one if none is idle"""
+    _tess_api_slots.acquire()
+    try:
+        return _tess_api_pool.get_nowait()
+    except queue.Empty:
+        logger.info("Starting tesseract engine")
+        try:
+            tesserocr, _ = load_ocr_modules()
+            return tesserocr.PyTessBaseAPI()
+        except Exception:
+            _tess_api_slots.release()
+            raise
+
+def release_tess_api(api):
+    """Return a tesseract engine to the pool, or drop it if it cannot be reset"""
+    try:
+        api.Clear()
+        _tess_api_pool.put_nowait(api)
+    finally:
+        _tess_api_slots.release()
+
+def ocr_image(image):
+    """Extract text from a PIL image with a pooled tesseract engine"""
+    api = acquire_tess_api()
+    try:
+        api.SetImage(image)
+        return api.GetUTF8Text()
+    finally:
+        release_tess_api(api)
+
+def ocr_image_bytes(data, width, height, bytes_per_pixel, bytes_per_line, dpi):
+    """Extract text from raw pixel data rendered at dpi with a pooled tesseract engine"""
+    api = acquire_tess_api()
+    try:
+        api.SetImageBytes(data, width, height, bytes_per_pixel, bytes_per_line)
+        api.SetSourceResolution(dpi)
+        return api.GetUTF8Text()
+    finally:
+        release_tess_api(api)
+
+# Recent OCR results, most recently used last, so resubmitted files skip OCR
+OCR_CACHE_SIZE = max(0, int(os.environ.get('OCR_CACHE_SIZE', 32)))
+_ocr_cache = collections.OrderedDict()
+_ocr_cache_lock = threading.Lock()
+
 @app.route('/', methods=['GET'])
 def home():
     return jsonify({
         "status": "online",
         "message": "PDF & Image Extraction API is running",
-        "usage": "Send a POST request to /extract-pdf with a base64-encoded PDF or image",
+        "usage": "Send a POST request to /extract-pdf with a base64-encoded PDF or image, a multipart 'pdf' file, or a raw application/pdf or image/* body",
         "features": ["Regular text extraction", "OCR for scanned documents and images"],
         "supported_formats": ["PDF", "JPG", "JPEG", "PNG", "BMP", "TIFF"],
         "version": "1.2.0"
     })
 
-def extract_text_with_ocr(file_bytes, is_image=False):
+def cache_ocr_results(func):
+    """Memoize OCR on the SHA-256 of the file plus the OCR options"""
+    @functools.wraps(func)
+    def wrapper(file_bytes, is_image=False, dpi=DEFAULT_OCR_DPI):
+        if not OCR_CACHE_SIZE:
+            return func(file_bytes, is_image=is_image, dpi=dpi)
+        
+        key = (hashlib.sha256(file_bytes).hexdigest(), is_image, dpi)
+        with _ocr_cache_lock:
+            if key in _ocr_cache:
+                _ocr_cache.move_to_end(key)
+                logger.info(f"Using cached OCR result for {key[0]}")
+                return _ocr_cache[key]
+        
+        text = func(file_bytes, is_image=is_image, dpi=dpi)
+        
+        with _ocr_cache_lock:
+            _ocr_cache[key] = text
+            while len(_ocr_cache) > OCR_CACHE_SIZE:
+                _ocr_cache.popitem(last=False)
+        return text
+    return wrapper
+
+@cache_ocr_results
+def extract_text_with_ocr(file_bytes, is_image=False, dpi=DEFAULT_OCR_DPI):
     """Extract text from PDF or image using OCR"""
     logger.info(f"Starting OCR extraction process for {'image' if is_image else 'PDF'}")
-    text = ""
+    text_parts = []
     
     try:
         # If it's already an image, process it directly
         if is_image:
             logger.info("Processing direct image with OCR")
-            with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as temp_img:
-                temp_img.write(file_bytes)
-                temp_path = temp_img.name
-            
             try:
-                # Open the image and extract text
-                image = Image.open(temp_path)
-                page_text = pytesseract.image_to_string(image)
+                # Decode the image in memory and extract text
+                _, Image = load_ocr_modules()
+                image = Image.open(io.BytesIO(file_bytes))
+                image.load()
+                page_text = ocr_image(image)
                 if page_text:
-                    text += page_text
+                    text_parts.append(page_text)
                 else:
                     logger.warning(f"No text extracted from image with OCR")
-                
-                # Clean up temp file
-                os.remove(temp_path)
             except Exception as e:
                 logger.error(f"Error processing image with OCR: {e}")
-                if os.path.exists(temp_path):
-                    os.remove(temp_path)
                 raise e
         else:
-            # For PDFs, convert to images first
-            with tempfile.TemporaryDirectory() as temp_dir:
-                # Convert PDF to images
-                logger.info("Converting PDF to images")
-                images = convert_from_bytes(
-                    file_bytes, 
-                    output_folder=temp_dir,
-                    fmt="jpeg",
-                    dpi=300
-                )
-                
-                logger.info(f"Converted {len(images)} pages to images")
-                
-                # Process each image with OCR
-                for i, image in enumerate(images):
-                    logger.info(f"Processing page {i+1} with OCR")
-                    # Use pytesseract to extract text
-                    page_text = pytesseract.image_to_string(image)
-                    if page_text:
-                        text += page_text + "\n\n"
-                    else:
-                        logger.warning(f"No text extracted from page {i+1} with OCR")
+            # For PDFs, render each page to a grayscale pixel buffer and pass
+            # it straight to tesseract, with no intermediate image files.
+            # pdfium is not thread-safe, so pages render on this thread while
+            # earlier pages are recognized on the pool.
+            logger.info("Rendering PDF pages for OCR")
+            page_texts = []
+            doc = open_pdf(file_bytes)
+            try:
+                with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_OCR_WORKERS) as executor:
+                    pending = collections.deque()
+                    for page in doc:
+                        # Bound the rendered pages waiting for OCR
+                        if len(pending) >= 2 * MAX_OCR_WORKERS:
+                            page_texts.append(pending.popleft().result())
+                        bitmap = page.render(scale=dpi / 72, grayscale=True)
+                        pending.append(executor.submit(
+                            ocr_image_bytes,
+                            bytes(bitmap.buffer),
+                            bitmap.width,
+                            bitmap.height,
+                            bitmap.n_channels,
+                            bitmap.stride,
+                            dpi
+                        ))
+                        page.close()
+                    page_texts.extend(future.result() for future in pending)
+            finally:
+                doc.close()
+            
+            logger.info(f"Processed {len(page_texts)} pages with OCR")
             
+            for i, page_text in enumerate(page_texts):
+                if page_text.strip():
+                    text_parts.append(page_text)
+                else:
+                    logger.warning(f"No text extracted from page {i+1} with OCR")
+            
+        text = "\n\n".join(text_parts)
         logger.info(f"OCR extraction complete, found {len(text)} characters")
         return text
     except Exception as e:
@@ -97,51 +266,151 @@ def is_image_data(file_data, file_type=None):
         return file_type.lower() in image_extensions
     
     # Check magic bytes (signatures) for common image formats
-    # JPG
-    if file_data.startswith(b'\xff\xd8\xff'):
-        return True
-    # PNG
-    if file_data.startswith(b'\x89PNG\r\n\x1a\n'):
-        return True
-    # BMP
-    if file_data.startswith(b'BM'):
-        return True
-    # GIF
-    if file_data.startswith(b'GIF87a') or file_data.startswith(b'GIF89a'):
-        return True
-    # TIFF
-    if file_data.startswith(b'II*\x00') or file_data.startswith(b'MM\x00*'):
-        return True
+    return IMAGE_SIGNATURE.match(file_data) is not None
+
+def open_pdf(file_bytes):
+    """Open a PDF with pdfium from bytes or a bytearray, without copying it"""
+    if isinstance(file_bytes, bytearray):
+        file_bytes = (ctypes.c_char * len(file_bytes)).from_buffer(file_bytes)
+    return pdfium.PdfDocument(file_bytes)
+
+def extract_text_with_pdfium(file_bytes, stop_if_scanned=False):
+    """Extract embedded text from a PDF using pdfium
+    
+    With stop_if_scanned, extraction stops early if the first pages have no
+    text objects or no text, since the PDF will be OCRed instead.
+    """
+    text_parts = []
+    doc = open_pdf(file_bytes)
+    try:
+        logger.info(f"PDF has {len(doc)} pages")
+        
+        # Pages without text objects can only contain scanned images, so skip
+        # extraction entirely when none of the first pages has one
+        probe_pages = range(min(SCANNED_PROBE_PAGES, len(doc)))
+        if stop_if_scanned and not any(has_text_objects(doc[i]) for i in probe_pages):
+            logger.info(f"No text objects on the first {SCANNED_PROBE_PAGES} pages, treating PDF as scanned")
+            return ""
+        
+        for i, page in enumerate(doc):
+            page_text = page.get_textpage().get_text_bounded().replace("\r\n", "\n")
+            page.close()
+            if page_text:
+                text_parts.append(page_text)
+            else:
+                logger.warning(f"No text extracted from page {i+1}")
+            if stop_if_scanned and i + 1 == SCANNED_PROBE_PAGES and not "".join(text_parts).strip():
+                logger.info(f"No text on the first {SCANNED_PROBE_PAGES} pages, treating PDF as scanned")
+                break
+    finally:
+        doc.close()
+    return "\n\n".join(text_parts)
+
+def has_text_objects(page):
+    """Check if a pdfium page draws any text, including inside form XObjects"""
+    try:
+        return next(page.get_objects(filter=[pdfium_c.FPDF_PAGEOBJ_TEXT]), None) is not None
+    finally:
+        page.close()
+
+def extract_text_with_pypdf2(file_bytes, stop_if_scanned=False):
+    """Extract embedded text from a PDF using PyPDF2 (see extract_text_with_pdfium)"""
+    text_parts = []
+    pdf_file = io.BytesIO(file_bytes)
+    reader = PyPDF2.PdfReader(pdf_file)
+    
+    logger.info(f"PDF has {len(reader.pages)} pages")
     
-    return False
+    for i, page in enumerate(reader.pages):
+        page_text = page.extract_text()
+        if page_text:
+            text_parts.append(page_text)
+        else:
+            logger.warning(f"No text extracted from page {i+1}")
+        if stop_if_scanned and i + 1 == SCANNED_PROBE_PAGES and not "".join(text_parts).strip():
+            logger.info(f"No text on the first {SCANNED_PROBE_PAGES} pages, treating PDF as scanned")
+            break
+    return "\n\n".join(text_parts)
+
+def read_request_stream(limit=MAX_UPLOAD_BYTES):
+    """Read a raw request body in chunks into a single bytearray
+    
+    The buffer is sized up front from Content-Length when it is known, so the
+    body is held once rather than as chunks plus a joined copy. Bodies longer
+    than limit are rejected as soon as they cross it.
+    """
+    expected = request.content_length
+    body = bytearray(expected) if expected is not None and expected <= limit else bytearray()
+    size = 0
+    while True:
+        chunk = request.stream.read(STREAM_CHUNK_SIZE)
+        if not chunk:
+            break
+        if size + len(chunk) > limit:
+            raise RequestEntityTooLarge()
+        body[size:size + len(chunk)] = chunk
+        size += len(chunk)
+    del body[size:]
+    return body
 
 @app.route('/extract-pdf', methods=['POST'])
 def extract_pdf():
     try:
-        # Check if request has JSON data
-        if not request.is_json:
-            logger.error("Request is not JSON")
-            return jsonify({"error": "Request must be JSON with a base64-encoded file"}), 400
-        
-        # Get base64 encoded PDF or image from request
-        file_base64 = request.json.get('pdf')
-        if not file_base64:
+        # Reject oversized uploads before reading the body
+        max_body_bytes = MAX_JSON_BODY_BYTES if request.is_json else MAX_UPLOAD_BYTES
+        if request.content_length is not None and request.content_length > max_body_bytes:
+            raise RequestEntityTooLarge()
+        
+        # Get the PDF or image and the request options. JSON requests carry
+        # the file base64-encoded; multipart and raw uploads are read as binary.
+        if request.is_json:
+            # Parse the body read through the capped stream reader; Werkzeug
+            # does not limit chunked bodies that have no Content-Length
+            try:
+                options = app.json.loads(read_request_stream(MAX_JSON_BODY_BYTES))
+            except ValueError as e:
+                logger.error(f"Failed to parse JSON body: {e}")
+                return jsonify({"error": "Request body is not valid JSON"}), 400
+            if not isinstance(options, dict):
+                logger.error("JSON body is not an object")
+                return jsonify({"error": "Request body must be a JSON object"}), 400
+            file_base64 = options.get('pdf') or ''
+            if not isinstance(file_base64, str):
+                logger.error(f"Invalid base64 value of type {type(file_base64).__name__}")
+                return jsonify({"error": "Invalid base64 encoding"}), 400
+            if len(file_base64) * 3 // 4 > MAX_UPLOAD_BYTES:
+                raise RequestEntityTooLarge()
+            try:
+                # Decode the base64 string (SIMD-accelerated where the CPU supports it)
+                file_bytes = pybase64.b64decode(file_base64, validate=False)
+            except Exception as e:
+                logger.error(f"Failed to decode base64: {e}")
+                return jsonify({"error": "Invalid base64 encoding"}), 400
+        elif request.mimetype == 'multipart/form-data':
+            # Werkzeug only enforces MAX_CONTENT_LENGTH on a declared length
+            if request.content_length is None:
+                logger.error("Multipart upload without Content-Length")
+                return jsonify({"error": "Multipart uploads must send a Content-Length header"}), 411
+            options = request.form
+            upload = request.files.get('pdf')
+            file_bytes = upload.read() if upload else b''
+        elif request.mimetype in RAW_UPLOAD_MIMETYPES or request.mimetype.startswith('image/'):
+            options = request.args
+            file_bytes = read_request_stream()
+        else:
+            logger.error(f"Unsupported content type: {request.mimetype}")
+            return jsonify({"error": "Request must be JSON with a base64-encoded file, multipart/form-data, or a raw PDF or image body"}), 400
+        
+        if not file_bytes:
             logger.error("No file data found in request")
             return jsonify({"error": "No file data found in request"}), 400
         
         # Get OCR preference (default to auto)
-        ocr_mode = request.json.get('ocr_mode', 'auto')  # Options: 'auto', 'force', 'disable'
-        file_type = request.json.get('file_type', '').lower()  # Optional file type hint
+        ocr_mode = options.get('ocr_mode', 'auto')  # Options: 'auto', 'force', 'disable'
+        file_type = options.get('file_type', '').lower()  # Optional file type hint
         
         logger.info(f"Received extraction request. OCR mode: {ocr_mode}, File type: {file_type or 'not specified'}. Processing...")
         
-        try:
-            # Decode the base64 string
-            file_bytes = base64.b64decode(file_base64)
-        except Exception as e:
-            logger.error(f"Failed to decode base64: {e}")
-            return jsonify({"error": "Invalid base64 encoding"}), 400
-        
         # Check if it's an image
         is_image = is_image_data(file_bytes, file_type)
         if is_image:
@@ -167,24 +436,18 @@ def extract_pdf():
         ocr_text = ""
         used_ocr = False
         
-        # Standard text extraction
+        # Standard text extraction, with PyPDF2 as a fallback for PDFs pdfium rejects
         if ocr_mode != 'force':
             try:
-                pdf_file = io.BytesIO(file_bytes)
-                reader = PyPDF2.PdfReader(pdf_file)
-                
-                logger.info(f"PDF has {len(reader.pages)} pages")
-                
-                for i, page in enumerate(reader.pages):
-                    page_text = page.extract_text()
-                    if page_text:
-                        regular_text += page_text + "\n\n"
-                    else:
-                        logger.warning(f"No text extracted from page {i+1}")
-                
-                logger.info(f"Regular extraction found {len(regular_text)} characters")
+                regular_text = extract_text_with_pdfium(file_bytes, stop_if_scanned=(ocr_mode == 'auto'))
             except Exception as e:
-                logger.warning(f"Regular extraction failed: {e}")
+                logger.warning(f"pdfium extraction failed, falling back to PyPDF2: {e}")
+                try:
+                    regular_text = extract_text_with_pypdf2(file_bytes, stop_if_scanned=(ocr_mode == 'auto'))
+                except Exception as e:
+                    logger.warning(f"Regular extraction failed: {e}")
+            
+            logger.info(f"Regular extraction found {len(regular_text)} characters")
         
         # Decide if OCR is needed
         should_use_ocr = (
@@ -194,9 +457,19 @@ def extract_pdf():
         
         # Run OCR if needed
         if should_use_ocr:
-            logger.info("Using OCR for text extraction")
+            # Get OCR rendering resolution (default to 200 DPI); it only
+            # applies here, so images and non-OCR requests ignore it
+            try:
+                dpi = int(options.get('dpi', DEFAULT_OCR_DPI))
+            except (TypeError, ValueError):
+                dpi = None
+            if dpi is None or not MIN_OCR_DPI <= dpi <= MAX_OCR_DPI:
+                logger.error(f"Invalid DPI requested: {options.get('dpi')}")
+                return jsonify({"error": f"dpi must be an integer between {MIN_OCR_DPI} and {MAX_OCR_DPI}"}), 400
+            
+            logger.info(f"Using OCR for text extraction at {dpi} DPI")
             try:
-                ocr_text = extract_text_with_ocr(file_bytes)
+                ocr_text = extract_text_with_ocr(file_bytes, dpi=dpi)
                 used_ocr = True
             except Exception as e:
                 logger.error(f"OCR extraction failed: {e}")
@@ -225,6 +498,9 @@ def extract_pdf():
             "file_type": "pdf"
         })
         
+    except RequestEntityTooLarge:
+        logger.error(f"Upload rejected, larger than {MAX_UPLOAD_MB} MB")
+        return jsonify({"error": f"File is too large, the maximum upload size is {MAX_UPLOAD_MB} MB"}), 413
     except Exception as e:
         logger.error(f"Extraction error: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 500
@@ -0,0 +1,20 @@
+# Gunicorn settings, loaded automatically by `gunicorn app:app`
+import os
+
+from app import WEB_WORKERS
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 10000)}"
+
+# One worker per available CPU unless WEB_CONCURRENCY is set. Each worker
+# sizes its OCR thread pool to its share of the CPUs.
+workers = WEB_WORKERS
+
+# One request thread per worker: pdfium is not thread-safe, and every request
+# opens and renders documents with it. Concurrency comes from workers instead.
+threads = 1
+
+# Import the app once before forking so workers share the loaded modules
+preload_app = True
+
+# OCR of long scanned documents can take minutes
+timeout = 300